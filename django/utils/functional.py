@@ -1,11 +1,27 @@
 import copy
+from collections import defaultdict, deque
+import itertools
 import operator
 from functools import wraps, total_ordering
 import sys
+import threading
+import time
+import types
 import warnings
+import weakref
 
 import six
 
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+try:
+    from concurrent import futures
+except ImportError:  # Python 2 without the futures backport
+    futures = None
+
 
 # QUESTION: What does functools.partial(...) do?
 # ANSWER: It returns an object of type functools.partial. It is a constructor,
@@ -15,11 +31,213 @@ import six
 # You can't trivially replace this with `functools.partial` because this binds
 # to classes and returns bound instances, whereas functools.partial (on
 # CPython) is a type and its instances don't bind.
-def curry(_curried_func, *args, **kwargs):
+def _make_curried(_curried_func, args, kwargs):
     def _curried(*moreargs, **morekwargs):
-        return _curried_func(*(args + moreargs), **dict(kwargs, **morekwargs))
+        # Only build a merged kwargs dict when there is something to merge.
+        if morekwargs:
+            return _curried_func(*(args + moreargs), **dict(kwargs, **morekwargs))
+        return _curried_func(*(args + moreargs), **kwargs)
+    # Expose the curried call for introspection, as functools.partial does.
+    _curried.func = _curried_func
+    _curried.args = args
+    _curried.keywords = kwargs
     return _curried
 
+# Every curry shares this code object, which is how curry() recognizes them.
+_curried_code = _make_curried(None, (), {}).__code__
+
+
+def curry(_curried_func, *args, **kwargs):
+    """
+    Curries _curried_func with the given positional and keyword arguments.
+
+    The result is a plain function, so it binds like a method when used as a
+    class attribute. Currying a curry is flattened into a single curry of the
+    original function.
+    """
+    # Bound methods pass __code__ and the other attributes through to their
+    # function, but flattening one would lose the instance it is bound to.
+    if type(_curried_func) is types.FunctionType and _curried_func.__code__ is _curried_code:
+        args = _curried_func.args + args
+        kwargs = dict(_curried_func.keywords, **kwargs)
+        _curried_func = _curried_func.func
+    return _make_curried(_curried_func, args, kwargs)
+
+
+_perf_counter = getattr(time, 'perf_counter', time.time)
+
+
+def _instrumentation_name(func):
+    # allow_lazy() promises call a _LazyGraphFunction wrapping the function.
+    func = getattr(func, 'func', func)
+    name = getattr(func, '__qualname__', None) or getattr(func, '__name__', None) or repr(func)
+    module = getattr(func, '__module__', None)
+    return '%s.%s' % (module, name) if module else name
+
+
+class Instrumentation(object):
+    """
+    Counters and timing histograms for the work hidden behind this module's
+    proxies, collected while instrumentation is enabled (see
+    enable_instrumentation()):
+
+    * 'lazy': calls of lazily evaluated functions, i.e. each time a Promise
+      is forced (cached lazy_cached() results excepted);
+    * 'setup': lazy object setups, keyed by setup function;
+    * 'cached_property': computations of cached properties.
+
+    The histograms count calls in power-of-two buckets of microseconds.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # (kind, name) -> [count, total seconds, {bucket: count}]
+            self.stats = {}
+            # id(promise) -> [weak reference to the promise, function name,
+            # count], for the promises that are still alive. Promises are
+            # only referenced weakly, so that instrumentation doesn't keep
+            # them (and their arguments) alive.
+            self.promises = {}
+            # function name -> [number of collected promises that were
+            # forced more than once, most times one of them was forced]
+            self.repeats = {}
+            # (id, weak reference) of the collected promises. Weak reference
+            # callbacks only append here: they can run at any time,
+            # including while self.promises is being changed.
+            self.collected = deque()
+
+    def call(self, kind, func, args, kw, promise=None):
+        """
+        Calls func(*args, **kw), recording the call under kind.
+        """
+        start = _perf_counter()
+        try:
+            return func(*args, **kw)
+        finally:
+            self.record(kind, func, _perf_counter() - start, promise)
+
+    def record(self, kind, func, elapsed, promise=None):
+        key = (kind, _instrumentation_name(func))
+        bucket = int(elapsed * 1e6).bit_length()
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = [0, 0.0, {}]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2][bucket] = stats[2].get(bucket, 0) + 1
+            if promise is not None:
+                self._count_promise(promise, key[1])
+
+    def _count_promise(self, promise, name):
+        self._forget_collected()
+        entry = self.promises.get(id(promise))
+        if entry is None or entry[0]() is not promise:
+            if entry is not None:
+                # A collected promise whose id was reused.
+                self._forget(id(promise))
+            collected = self.collected
+            ref = weakref.ref(promise, lambda ref, key=id(promise): collected.append((key, ref)))
+            entry = self.promises[id(promise)] = [ref, name, 0]
+        entry[2] += 1
+
+    def _forget_collected(self):
+        while self.collected:
+            key, ref = self.collected.popleft()
+            entry = self.promises.get(key)
+            if entry is not None and entry[0] is ref:
+                self._forget(key)
+
+    def _forget(self, key):
+        ref, name, count = self.promises.pop(key)
+        if count > 1:
+            repeats = self.repeats.setdefault(name, [0, 0])
+            repeats[0] += 1
+            repeats[1] = max(repeats[1], count)
+
+    def snapshot(self):
+        """
+        Returns the collected data as a dict of plain types, e.g.:
+
+            {'lazy': {'myapp.views.label': {
+                'count': 3, 'total': 0.0004,
+                'histogram': {'<128us': 2, '<256us': 1}}},
+             'setup': {}, 'cached_property': {},
+             'repeated': [{'function': 'myapp.views.label',
+                           'promises': 1, 'max_count': 2}]}
+
+        'repeated' lists, per function, how many of its promises were forced
+        more than once, and the most times one of them was forced. Functions
+        with the most forced promise come first.
+        """
+        with self.lock:
+            result = {'lazy': {}, 'setup': {}, 'cached_property': {}}
+            for (kind, name), (count, total, histogram) in self.stats.items():
+                result.setdefault(kind, {})[name] = {
+                    'count': count,
+                    'total': total,
+                    'histogram': dict(('<%dus' % (1 << bucket), n) for bucket, n in histogram.items()),
+                }
+            self._forget_collected()
+            repeats = dict((name, list(counts)) for name, counts in self.repeats.items())
+            for ref, name, count in self.promises.values():
+                if count > 1:
+                    counts = repeats.setdefault(name, [0, 0])
+                    counts[0] += 1
+                    counts[1] = max(counts[1], count)
+        repeated = [
+            {'function': name, 'promises': promises, 'max_count': max_count}
+            for name, (promises, max_count) in repeats.items()
+        ]
+        result['repeated'] = sorted(repeated, key=operator.itemgetter('max_count'), reverse=True)
+        return result
+
+
+# The active Instrumentation, or None. The hooks check it before anything
+# else, so disabled instrumentation costs them a global lookup.
+_instrumentation = None
+
+
+def enable_instrumentation():
+    """
+    Starts recording instrumentation data, if it wasn't already, and returns
+    the Instrumentation collecting it.
+    """
+    global _instrumentation
+    if _instrumentation is None:
+        _instrumentation = Instrumentation()
+    return _instrumentation
+
+
+def disable_instrumentation():
+    """
+    Stops recording instrumentation data, and returns the Instrumentation
+    that collected it (None if it wasn't enabled).
+    """
+    global _instrumentation
+    instrumentation, _instrumentation = _instrumentation, None
+    return instrumentation
+
+
+def _setup_lazy_object(lazy_object):
+    # Calls lazy_object._setup(), recording it if instrumentation is enabled.
+    if _instrumentation is None:
+        lazy_object._setup()
+        return
+    # Attribute access on lazy_object would be proxied, and may set it up.
+    try:
+        func = object.__getattribute__(lazy_object, '_setupfunc')
+    except AttributeError:
+        func = type(lazy_object)._setup
+    start = _perf_counter()
+    try:
+        lazy_object._setup()
+    finally:
+        _instrumentation.record('setup', func, _perf_counter() - start)
+
 
 class cached_property(object):
     """
@@ -65,9 +283,236 @@ class cached_property(object):
             return self
         # REVIEW: Compute the result, then store it, overwriting the
         # cached_property object and leaving behind the permanent result.
-        res = instance.__dict__[self.func.__name__] = self.func(instance)
+        if _instrumentation is None:
+            res = self.func(instance)
+        else:
+            res = _instrumentation.call('cached_property', self.func, (instance,), {})
+        instance.__dict__[self.func.__name__] = res
         return res
 
+    def clear(self, instance):
+        """
+        Discards the value cached on instance, if any.
+        """
+        instance.__dict__.pop(self.func.__name__, None)
+
+
+class threadsafe_cached_property(cached_property):
+    """
+    A cached_property that is computed only once when several threads access
+    it for the first time concurrently. The other threads wait for that
+    computation and get the same cached value.
+    """
+    def __init__(self, func):
+        super(threadsafe_cached_property, self).__init__(func)
+        # Guards self.locks.
+        self.lock = threading.Lock()
+        # id(instance) -> [lock, number of threads using it], for the
+        # instances whose value is being computed. The locks are kept here
+        # rather than on the instances, so that nothing is left behind on an
+        # instance (where it would break copying and pickling) if the
+        # computation raises.
+        self.locks = {}
+
+    def __get__(self, instance, type=None):
+        if instance is None:
+            return self
+        # Once the value is cached, instance.__dict__ shadows this descriptor,
+        # so only the first accesses get here.
+        name = self.func.__name__
+        key = id(instance)
+        with self.lock:
+            entry = self.locks.get(key)
+            if entry is None:
+                entry = self.locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                # Another thread may have computed the value while we waited.
+                # If that computation raised, compute it again.
+                if name not in instance.__dict__:
+                    if _instrumentation is None:
+                        instance.__dict__[name] = self.func(instance)
+                    else:
+                        instance.__dict__[name] = _instrumentation.call('cached_property', self.func, (instance,), {})
+                return instance.__dict__[name]
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
+
+class async_cached_property(cached_property):
+    """
+    Decorator that converts a coroutine method with a single self argument
+    into an awaitable property cached on the instance.
+
+    The first access schedules the coroutine as a task on the running event
+    loop and caches the task. Concurrent and later accesses get the same
+    task, which is already resolved once the coroutine has finished. If the
+    coroutine raises or is cancelled, the task is discarded so that the next
+    access runs it again.
+    """
+    def __get__(self, instance, type=None):
+        if instance is None:
+            return self
+        name = self.func.__name__
+        # Find the loop before creating the coroutine: outside of one, this
+        # raises RuntimeError without leaving a never-awaited coroutine behind.
+        try:
+            get_loop = asyncio.get_running_loop
+        except AttributeError:
+            # Python < 3.7.
+            get_loop = asyncio.get_event_loop
+        loop = get_loop()
+        task = instance.__dict__[name] = loop.create_task(self.func(instance))
+        instrumentation, start = _instrumentation, _perf_counter()
+
+        def discard_failure(task):
+            if instrumentation is not None:
+                # Records the time until the task finished, not the time it
+                # took to create the coroutine.
+                instrumentation.record('cached_property', self.func, _perf_counter() - start)
+            if task.cancelled() or task.exception() is not None:
+                # Only discard the task if it is still the cached one.
+                if instance.__dict__.get(name) is task:
+                    del instance.__dict__[name]
+        task.add_done_callback(discard_failure)
+        return task
+
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class expiring_cached_property(cached_property):
+    """
+    A cached_property whose value can expire, and which also works on classes
+    that have no instance __dict__.
+
+    If ttl is given, the value is recomputed on the first access more than
+    ttl seconds after it was computed. Where the value is stored depends on
+    the class: in the named slot if slot is given, otherwise in the instance
+    __dict__, otherwise in a table keyed by the identity of the instance.
+    The table needs a weak reference to the instance to know when to drop
+    its entry, so a class with neither a __dict__ nor a slot for the value
+    must have __weakref__ in its __slots__.
+
+    Can be used directly as a decorator, or called with options first:
+
+        @expiring_cached_property(ttl=60, slot='_settings_cache')
+        def settings(self):
+            ...
+    """
+    def __init__(self, func=None, ttl=None, slot=None):
+        self.func = func
+        self.ttl = ttl
+        self.slot = slot
+        # id(instance) -> (weak reference to instance, entry). Keying on the
+        # id rather than on the instance keeps instances that compare equal
+        # apart, and works for unhashable ones.
+        self.weak_entries = {}
+
+    def __call__(self, func):
+        if self.func is not None:
+            raise TypeError("'%s' object is not callable" % type(self).__name__)
+        self.func = func
+        return self
+
+    # Each entry is a (value, expires) tuple, expires being None if the value
+    # never expires.
+    def _get_entry(self, instance):
+        if self.slot is not None:
+            return getattr(instance, self.slot, None)
+        try:
+            return instance.__dict__.get(self.func.__name__)
+        except AttributeError:
+            item = self.weak_entries.get(id(instance))
+            # The id may belong to a collected instance whose entry hasn't
+            # been dropped yet.
+            if item is not None and item[0]() is instance:
+                return item[1]
+            return None
+
+    def _set_entry(self, instance, entry):
+        if self.slot is not None:
+            setattr(instance, self.slot, entry)
+            return
+        try:
+            instance.__dict__[self.func.__name__] = entry
+        except AttributeError:
+            key = id(instance)
+            item = self.weak_entries.get(key)
+            if item is not None and item[0]() is instance:
+                ref = item[0]
+            else:
+                ref = self._weak_reference(instance, key)
+            self.weak_entries[key] = (ref, entry)
+
+    def _weak_reference(self, instance, key):
+        weak_entries = self.weak_entries
+
+        def discard(ref):
+            # Only drop the entry if it still belongs to this instance.
+            item = weak_entries.get(key)
+            if item is not None and item[0] is ref:
+                del weak_entries[key]
+        try:
+            return weakref.ref(instance, discard)
+        except TypeError:
+            raise TypeError(
+                "expiring_cached_property needs somewhere to store %s.%s: "
+                "give %s a __dict__ or a __weakref__ slot, or pass slot." % (
+                    type(instance).__name__, self.func.__name__, type(instance).__name__))
+
+    def __get__(self, instance, type=None):
+        if instance is None:
+            return self
+        # This is a data descriptor (it defines __set__), so it is consulted
+        # on every access, even though the entry may live in __dict__.
+        entry = self._get_entry(instance)
+        if entry is not None and (entry[1] is None or entry[1] > _monotonic()):
+            return entry[0]
+        if _instrumentation is None:
+            res = self.func(instance)
+        else:
+            res = _instrumentation.call('cached_property', self.func, (instance,), {})
+        self.__set__(instance, res)
+        return res
+
+    def __set__(self, instance, value):
+        expires = None if self.ttl is None else _monotonic() + self.ttl
+        self._set_entry(instance, (value, expires))
+
+    def __delete__(self, instance):
+        self.clear(instance)
+
+    def clear(self, instance):
+        if self.slot is not None:
+            self._set_entry(instance, None)
+            return
+        try:
+            instance.__dict__.pop(self.func.__name__, None)
+        except AttributeError:
+            item = self.weak_entries.get(id(instance))
+            if item is not None and item[0]() is instance:
+                del self.weak_entries[id(instance)]
+
+
+def clear_cached_properties(instance):
+    """
+    Discards the values of all cached properties (of any of the
+    cached_property types above) cached on instance.
+    """
+    seen = set()
+    for klass in type(instance).__mro__:
+        for name, attr in klass.__dict__.items():
+            if name in seen:
+                continue
+            seen.add(name)
+            if isinstance(attr, cached_property):
+                attr.clear(instance)
+
 
 # REVIEW: Not nearly as feature-ful as aplus promises, or as python futures.
 # But it does have unique features of its own. Unlike those two classes,
@@ -80,30 +525,32 @@ class cached_property(object):
 # class. But Promise is not publicly documented for external use.
 class Promise(object):
     """
-    This is just a base class for the proxy class created in
-    the closure of the lazy function. It can be used to recognize
-    promises in code.
+    This is just a base class for the proxy class created by
+    the lazy function. It can be used to recognize promises in code.
     """
-    pass
+    # No per-instance __dict__, so that the __proxy__ subclasses can be
+    # compact.
+    __slots__ = ()
 
 
-# REVIEW: This is a higher-order function. It accepts a function, and returns
-# another function. It does not return an object. So the result relies on a
-# closure to remember the values of func and resultclasses, so that they can be
-# used in the implementations of various methods of the private __proxy__
-# class.
-# REVIEW: If resultclasses were a list instead of var-args, you could reverse
-# the order of the arguments (def lazy(resultclasses, func)) and then use
-# curry() to create a decorator.
-# REVIEW: Why no memoizing? I don't know, can't find any explantion in the
-# comments, git logs, or bug tracker.
-def lazy(func, *resultclasses):
+# Prepared __proxy__ classes, keyed by the resultclasses tuple. Every lazy()
+# call with the same result types shares one class, so the dispatch table and
+# the __promise__ wrapper methods are only built once per process.
+_lazy_proxy_classes = {}
+
+
+# The __proxy__ class only depends on resultclasses. The lazily evaluated
+# function is stored on each instance, not captured in a closure, so that the
+# class (and its dispatch table) can be shared.
+def _lazy_proxy_class(resultclasses):
     """
-    Turns any callable into a lazy evaluated callable. You need to give result
-    classes or types -- at least one is needed so that the automatic forcing of
-    the lazy evaluation code is triggered. Results are not memoized; the
-    function is evaluated on every access.
+    Returns the prepared __proxy__ class for the given tuple of result
+    classes, creating and caching it on first use.
     """
+    try:
+        return _lazy_proxy_classes[resultclasses]
+    except KeyError:
+        pass
 
     # QUESTION: Who knows what @total_ordering does?
     # ANSWER: From the Python documentation:
@@ -122,23 +569,31 @@ def lazy(func, *resultclasses):
         called on the result of that function. The function is not evaluated
         until one of the methods on the result is called.
         """
+        # __weakref__ lets caches and registries refer to promises without
+        # keeping them alive.
+        __slots__ = ('__func', '__args', '__kw', '__weakref__')
         __dispatch = None
 
-        def __init__(self, args, kw):
+        def __init__(self, func, args, kw):
+            self.__func = func
             self.__args = args
             self.__kw = kw
-            # REVIEW: Why is this check necessary? __proxy__ is only used in
-            # __wrapper__, and it is immediately initialized. There is no point
-            # when __proxy__.__dispatch (the class attribute) is ever anything
-            # but None, so this condition should always be True.
-            if self.__dispatch is None:
-                self.__prepare_class__()
+
+        def __evaluate(self):
+            # Every access to the result goes through here, so that subclasses
+            # (see _lazy_cached_proxy_class) can memoize it.
+            if _instrumentation is None:
+                return self.__func(*self.__args, **self.__kw)
+            return _instrumentation.call('lazy', self.__func, self.__args, self.__kw, self)
 
         @classmethod
         def __prepare_class__(cls):
             # REVIEW: __dispatch is a mapping from resultclasses, to
             # method_name -> method_object mappings.
             cls.__dispatch = {}
+            # Per-method caches of type(result) -> resolved method, shared by
+            # every __wrapper__ built for the same method name.
+            cls.__resolved = {}
             for resultclass in resultclasses:
                 cls.__dispatch[resultclass] = {}
                 # QUESTION: What is mro()? Why reversed?
@@ -170,12 +625,28 @@ def lazy(func, *resultclasses):
                             # meth needs.
                             continue
                         setattr(cls, k, meth)
+            # Fast path: a result whose type is exactly one of the
+            # resultclasses resolves straight to its dispatch entry.
+            for funcname, resolved in cls.__resolved.items():
+                for resultclass in resultclasses:
+                    if funcname in cls.__dispatch[resultclass]:
+                        resolved[resultclass] = cls.__dispatch[resultclass][funcname]
             # REVIEW: The six module is used for python2 / python3
             # compatibility. Because of the breaking change to text types in
             # python3 and the incompatibility (in both python2 and python3)
             # between bytes and text, special code is needed here, and text and
             # bytes can't be mixed. This code is important to Django, because
             # one of the main uses of lazy() is for lazy translations.
+            # The dispatched __add__ of text raises TypeError when given a
+            # rope, instead of returning NotImplemented so that the rope's
+            # __radd__ can compose them.
+            add = cls.__dict__.get('__add__')
+            if add is not None:
+                def __add__(self, other):
+                    if isinstance(other, LazyRope):
+                        return NotImplemented
+                    return add(self, other)
+                cls.__add__ = __add__
             cls._delegate_bytes = bytes in resultclasses
             cls._delegate_text = six.text_type in resultclasses
             assert not (cls._delegate_bytes and cls._delegate_text), "Cannot call lazy() with both bytes and text return types."
@@ -199,24 +670,19 @@ def lazy(func, *resultclasses):
         def __promise__(cls, klass, funcname, method):
             # Builds a wrapper around some magic method and registers that
             # magic method for the given type and method name.
+            resolved = cls.__resolved.setdefault(funcname, {})
+
             def __wrapper__(self, *args, **kw):
                 # Automatically triggers the evaluation of a lazy value and
                 # applies the given magic method of the result type.
                 # REVIEW: Only funcname is used in here. klass and method are
                 # only used outside the definition for __wrapper__.
-                res = func(*self.__args, **self.__kw)
-                # REVIEW: Iterate forward through the mro(), so we get the
-                # correct method override.
-                for t in type(res).mro():
-                    # REVIEW: We only care about classes in resultclasses /
-                    # self.__dispatch.
-                    if t in self.__dispatch:
-                        # REVIEW: Remember: the only things in __dispatch are
-                        # the resultclasses, and they have items for each
-                        # method on each superclass. So funcname will never be
-                        # missing.
-                        return self.__dispatch[t][funcname](res, *args, **kw)
-                raise TypeError("Lazy object returned unexpected type.")
+                res = self.__evaluate()
+                try:
+                    meth = resolved[type(res)]
+                except KeyError:
+                    meth = resolved[type(res)] = cls.__resolve(type(res), funcname)
+                return meth(res, *args, **kw)
 
             # REVIEW: This state gets set even if the __wrapper__ is discarded
             # by the caller.
@@ -231,11 +697,28 @@ def lazy(func, *resultclasses):
             cls.__dispatch[klass][funcname] = method
             return __wrapper__
 
+        @classmethod
+        def __resolve(cls, type_, funcname):
+            # Finds the dispatched method for funcname on results of type_.
+            # __wrapper__ caches the answer, so this runs once per type.
+            # REVIEW: Iterate forward through the mro(), so we get the
+            # correct method override.
+            for t in type_.mro():
+                # REVIEW: We only care about classes in resultclasses /
+                # cls.__dispatch.
+                if t in cls.__dispatch:
+                    # REVIEW: Remember: the only things in __dispatch are
+                    # the resultclasses, and they have items for each
+                    # method on each superclass. So funcname will never be
+                    # missing.
+                    return cls.__dispatch[t][funcname]
+            raise TypeError("Lazy object returned unexpected type.")
+
         def __text_cast(self):
-            return func(*self.__args, **self.__kw)
+            return self.__evaluate()
 
         def __bytes_cast(self):
-            return bytes(func(*self.__args, **self.__kw))
+            return bytes(self.__evaluate())
 
         # QUESTION: What does leading double-underscores in a method name do?
         # ANSWER: It is the closest thing to a private method that Python has.
@@ -251,21 +734,21 @@ def lazy(func, *resultclasses):
             elif self._delegate_text:
                 return self.__text_cast()
             else:
-                return func(*self.__args, **self.__kw)
+                return self.__evaluate()
 
         def __ne__(self, other):
-            if isinstance(other, Promise):
-                other = other.__cast()
+            # _force() also handles ropes, and Promises that aren't proxies.
+            other = _force(other)
             return self.__cast() != other
 
         def __eq__(self, other):
-            if isinstance(other, Promise):
-                other = other.__cast()
+            # _force() also handles ropes, and Promises that aren't proxies.
+            other = _force(other)
             return self.__cast() == other
 
         def __lt__(self, other):
-            if isinstance(other, Promise):
-                other = other.__cast()
+            # _force() also handles ropes, and Promises that aren't proxies.
+            other = _force(other)
             return self.__cast() < other
 
         def __hash__(self):
@@ -285,6 +768,142 @@ def lazy(func, *resultclasses):
             memo[id(self)] = self
             return self
 
+        def __reduce__(self):
+            # The class itself can't be pickled (it's defined in a closure),
+            # so pickle the function call and rebuild the proxy with lazy().
+            return (_unpickle_lazy_proxy,
+                    _function_reference(self.__func) + (resultclasses, self.__args, self.__kw))
+
+    __proxy__.__prepare_class__()
+    # If another thread prepared the same class first, use that one.
+    return _lazy_proxy_classes.setdefault(resultclasses, __proxy__)
+
+
+_lazy_cached_proxy_classes = {}
+
+
+def _lazy_cached_proxy_class(resultclasses):
+    """
+    Returns the memoizing subclass of the __proxy__ class for the given tuple
+    of result classes, creating and caching it on first use.
+    """
+    try:
+        return _lazy_cached_proxy_classes[resultclasses]
+    except KeyError:
+        pass
+
+    # The dispatch table and the wrapper methods are inherited from the
+    # shared, already prepared class. The subclass has the same name, so the
+    # mangled private names (e.g. __evaluate) line up.
+    class __proxy__(_lazy_proxy_class(resultclasses)):
+        """
+        A __proxy__ that stores the result of the function call, together
+        with the context key it was computed under.
+        """
+        __slots__ = ('__context', '__cached')
+
+        def __init__(self, func, args, kw, context=None):
+            _super(__proxy__, self).__init__(func, args, kw)
+            self.__context = context
+            self.__cached = None
+
+        def __evaluate(self):
+            key = self.__context() if self.__context is not None else None
+            cached = self.__cached
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            res = _super(__proxy__, self).__evaluate()
+            self.__cached = (key, res)
+            return res
+
+        def __reduce__(self):
+            # The memoized result is not pickled.
+            return (_unpickle_lazy_proxy,
+                    _function_reference(self.__func) + (resultclasses, self.__args, self.__kw, True, self.__context))
+
+    return _lazy_cached_proxy_classes.setdefault(resultclasses, __proxy__)
+
+
+def _function_reference(func):
+    # Returns (target, unwrap) such that target can be pickled by reference
+    # and func is target, or target.__wrapped__ if unwrap is True. A function
+    # decorated with lazy() or allow_lazy() can't be pickled as itself: its
+    # module-level name is bound to the decorated function instead.
+    target = sys.modules.get(getattr(func, '__module__', None))
+    for part in getattr(func, '__qualname__', getattr(func, '__name__', '')).split('.'):
+        target = getattr(target, part, None)
+    if target is not func and getattr(target, '__wrapped__', None) is func:
+        return (target, True)
+    return (func, False)
+
+
+def _unpickle_lazy_proxy(func, unwrap, resultclasses, args, kw, cached=False, context=None):
+    if unwrap:
+        func = func.__wrapped__
+    if cached:
+        return _lazy_cached_proxy_class(resultclasses)(func, args, kw, context)
+    return _lazy_proxy_class(resultclasses)(func, args, kw)
+
+
+# Eager resolution: the number of eager_resolution blocks active in any
+# thread, so that the lazy wrappers only look at the thread-local depth while
+# some thread is in one.
+_eager_users = 0
+_eager_lock = threading.Lock()
+_eager_state = threading.local()
+
+
+class eager_resolution(object):
+    """
+    Context manager within which lazy(), lazy_cached() and allow_lazy()
+    functions called by the current thread evaluate right away and return
+    plain values instead of promises. allow_lazy() functions force the
+    promises they are given.
+
+    Use it where the context promises depend on (e.g. the active language)
+    is fixed for a whole job, so that the job doesn't pay for proxying:
+
+        with eager_resolution():
+            export(rows)
+
+    Blocks can be nested. Other threads are not affected.
+    """
+    def __enter__(self):
+        global _eager_users
+        with _eager_lock:
+            _eager_users += 1
+        _eager_state.depth = getattr(_eager_state, 'depth', 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _eager_users
+        _eager_state.depth -= 1
+        with _eager_lock:
+            _eager_users -= 1
+
+
+# REVIEW: This is a higher-order function. It accepts a function, and returns
+# another function. It does not return an object. So the result relies on a
+# closure to remember the values of func and the __proxy__ class for
+# resultclasses.
+# REVIEW: If resultclasses were a list instead of var-args, you could reverse
+# the order of the arguments (def lazy(resultclasses, func)) and then use
+# curry() to create a decorator.
+# REVIEW: Why no memoizing? I don't know, can't find any explantion in the
+# comments, git logs, or bug tracker.
+def lazy(func, *resultclasses):
+    """
+    Turns any callable into a lazy evaluated callable. You need to give result
+    classes or types -- at least one is needed so that the automatic forcing of
+    the lazy evaluation code is triggered. Results are not memoized; the
+    function is evaluated on every access (see lazy_cached for a memoizing
+    variant).
+
+    All lazy callables with the same result classes share one prepared
+    __proxy__ class.
+    """
+    __proxy__ = _lazy_proxy_class(resultclasses)
+
     @wraps(func)
     # REVIEW: This is the result of the higher-order lazy() function. Calls to
     # the lazily-evaluated function are actually calls to __wrapper__. Calling
@@ -293,31 +912,610 @@ def lazy(func, *resultclasses):
     # list resultclasses. The result object is what we get after calling func
     # with *args and **kw.
     def __wrapper__(*args, **kw):
+        if _eager_users and getattr(_eager_state, 'depth', 0):
+            return func(*args, **kw)
         # Creates the proxy object, instead of the actual value.
-        return __proxy__(args, kw)
+        return __proxy__(func, args, kw)
+
+    # functools.wraps only sets __wrapped__ on Python 3. Pickling promises
+    # relies on it.
+    __wrapper__.__wrapped__ = func
+    return __wrapper__
+
+
+def lazy_cached(func, *resultclasses, **kwargs):
+    """
+    Like lazy(), but each proxy memoizes the result of the function the first
+    time it is needed.
+
+    Pass a callable as the ``context`` keyword argument to make the memoized
+    result depend on it, e.g. the function that returns the active language,
+    or the current value of a generation counter. The result is recomputed
+    whenever the value returned by ``context()`` changes.
+    """
+    context = kwargs.pop('context', None)
+    if kwargs:
+        raise TypeError("lazy_cached() got an unexpected keyword argument '%s'" % next(iter(kwargs)))
+    __proxy__ = _lazy_cached_proxy_class(resultclasses)
 
+    @wraps(func)
+    def __wrapper__(*args, **kw):
+        if _eager_users and getattr(_eager_state, 'depth', 0):
+            return func(*args, **kw)
+        return __proxy__(func, args, kw, context)
+
+    __wrapper__.__wrapped__ = func
     return __wrapper__
 
 
+@total_ordering
+class LazyRope(Promise):
+    """
+    A lazy piece of text built by concatenating and interpolating text and
+    promises, without evaluating any of them.
+
+    Adding to a rope (on either side) and interpolating it with % or
+    format() return new ropes in O(1). The text is only built by render(),
+    in a single pass over all the pieces, or written piece by piece to a
+    file-like object by write_to(). Like a lazy() promise, the rope is
+    evaluated again every time it is used as text.
+    """
+    __slots__ = ('pieces',)
+
+    def __init__(self, pieces=()):
+        self.pieces = tuple(pieces)
+
+    def _emit(self, write):
+        # Calls write() with the text of each piece, in order. Walk the tree
+        # of ropes with an explicit stack, so that long chains of additions
+        # don't hit the recursion limit.
+        stack = [self]
+        pop, extend = stack.pop, stack.extend
+        text_type = six.text_type
+        while stack:
+            piece = pop()
+            if isinstance(piece, text_type):
+                write(piece)
+            elif isinstance(piece, LazyRope):
+                if isinstance(piece, _LazyInterpolation):
+                    write(piece.interpolate())
+                else:
+                    extend(reversed(piece.pieces))
+            else:
+                write(text_type(piece))
+
+    def render(self):
+        pieces = []
+        self._emit(pieces.append)
+        return ''.join(pieces)
+
+    def write_to(self, fileobj):
+        """
+        Writes the text to fileobj piece by piece, without building the
+        whole string.
+        """
+        self._emit(fileobj.write)
+
+    def __add__(self, other):
+        return LazyRope((self, other))
+
+    def __radd__(self, other):
+        return LazyRope((other, self))
+
+    def __mod__(self, rhs):
+        return _LazyInterpolation(self, '%', rhs)
+
+    def format(self, *args, **kwargs):
+        return _LazyInterpolation(self, 'format', args, kwargs)
+
+    if six.PY3:
+        __str__ = render
+    else:
+        __unicode__ = render
+
+        def __str__(self):
+            return self.render().encode('utf-8')
+
+    def __getattr__(self, name):
+        # Other text methods act on the rendered text.
+        # Private names, e.g. a __proxy__'s mangled ones, aren't forwarded.
+        if name.startswith('_') or name in ('pieces', 'template', 'method', 'args', 'kwargs'):
+            raise AttributeError(name)
+        return getattr(self.render(), name)
+
+    def __len__(self):
+        return len(self.render())
+
+    def __contains__(self, item):
+        return _force(item) in self.render()
+
+    def __eq__(self, other):
+        return self.render() == _force(other)
+
+    def __ne__(self, other):
+        return self.render() != _force(other)
+
+    def __lt__(self, other):
+        return self.render() < _force(other)
+
+    def __hash__(self):
+        return hash(self.render())
+
+    def __repr__(self):
+        return '<%s: %d pieces>' % (type(self).__name__, len(self.pieces))
+
+    def __deepcopy__(self, memo):
+        # Ropes are immutable.
+        memo[id(self)] = self
+        return self
+
+
+class _LazyInterpolation(LazyRope):
+    """
+    A rope piece that interpolates args (and kwargs) into a template with %
+    or str.format when it is rendered.
+    """
+    __slots__ = ('template', 'method', 'args', 'kwargs')
+
+    def __init__(self, template, method, args, kwargs=None):
+        _super(_LazyInterpolation, self).__init__()
+        self.template = template
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return '<%s: %r %s %r>' % (type(self).__name__, self.template, self.method, self.args)
+
+    def interpolate(self):
+        template = _force(self.template)
+        if not isinstance(template, six.text_type):
+            template = six.text_type(template)
+        if self.method == 'format':
+            args = [_force(arg) for arg in self.args]
+            kwargs = dict((k, _force(v)) for k, v in self.kwargs.items())
+            return template.format(*args, **kwargs)
+        args = self.args
+        if isinstance(args, tuple):
+            args = tuple(_force(arg) for arg in args)
+        elif isinstance(args, dict):
+            args = dict((k, _force(v)) for k, v in args.items())
+        else:
+            args = _force(args)
+        return template % args
+
+
+def lazy_join(sep, pieces):
+    """
+    Returns a LazyRope of pieces (text or promises) separated by sep, like
+    sep.join(pieces) but without evaluating any promise.
+    """
+    joined = []
+    for piece in pieces:
+        if joined:
+            joined.append(sep)
+        joined.append(piece)
+    return LazyRope(joined)
+
+
+# In-flight futures of alazy() calls, keyed by (event loop, function, args,
+# kwargs), shared by concurrent awaits of the same call.
+_alazy_in_flight = {}
+
+
+class LazyAwaitable(object):
+    """
+    The result of calling an alazy() function: a deferred function call that
+    is evaluated by awaiting it.
+
+    Each await evaluates the call again, unless an identical call (same
+    function, args and kwargs, on the same event loop) is already in flight,
+    in which case its result is shared.
+    """
+    __slots__ = ('func', 'resultclasses', 'executor', 'args', 'kw')
+
+    def __init__(self, func, resultclasses, executor, args, kw):
+        self.func = func
+        self.resultclasses = resultclasses
+        self.executor = executor
+        self.args = args
+        self.kw = kw
+
+    def _start(self, loop):
+        if asyncio.iscoroutinefunction(self.func):
+            inner = loop.create_task(self.func(*self.args, **self.kw))
+        else:
+            inner = loop.run_in_executor(self.executor, curry(self.func, *self.args, **self.kw))
+        result = loop.create_future()
+
+        def check_result(inner):
+            # The same check as __proxy__ does when it dispatches a method.
+            if result.cancelled():
+                return
+            if inner.cancelled():
+                result.cancel()
+            elif inner.exception() is not None:
+                result.set_exception(inner.exception())
+            elif not isinstance(inner.result(), self.resultclasses):
+                result.set_exception(TypeError("Lazy object returned unexpected type."))
+            else:
+                result.set_result(inner.result())
+        inner.add_done_callback(check_result)
+        return result
+
+    def _future(self):
+        loop = asyncio.get_event_loop()
+        key = (loop, self.func, self.args, tuple(sorted(self.kw.items())))
+        try:
+            future = _alazy_in_flight.get(key)
+        except TypeError:
+            # Unhashable arguments: the call can't be shared.
+            return self._start(loop)
+        if future is None:
+            future = _alazy_in_flight[key] = self._start(loop)
+
+            def forget(future):
+                if _alazy_in_flight.get(key) is future:
+                    del _alazy_in_flight[key]
+            future.add_done_callback(forget)
+        return future
+
+    def __await__(self):
+        # Shield the shared future, so that cancelling one awaiter doesn't
+        # cancel the computation for the others.
+        return asyncio.shield(self._future()).__await__()
+
+    def __repr__(self):
+        return '<%s: %r, args=%r, kw=%r>' % (type(self).__name__, self.func, self.args, self.kw)
+
+
+def alazy(func, *resultclasses, **kwargs):
+    """
+    Turns a callable into one whose calls return awaitable LazyAwaitable
+    objects instead of being evaluated. Like lazy(), at least one result class
+    is needed; the result is checked against them when it is available.
+
+    Coroutine functions are run on the awaiting event loop. Other functions
+    are run in the executor given as the ``executor`` keyword argument (by
+    default, the loop's default executor).
+    """
+    executor = kwargs.pop('executor', None)
+    if kwargs:
+        raise TypeError("alazy() got an unexpected keyword argument '%s'" % next(iter(kwargs)))
+    if not resultclasses:
+        raise TypeError("alazy() needs at least one result class.")
+
+    @wraps(func)
+    def __wrapper__(*args, **kw):
+        return LazyAwaitable(func, resultclasses, executor, args, kw)
+
+    __wrapper__.__wrapped__ = func
+    return __wrapper__
+
+
+def _force(value):
+    # Returns the result of a lazy() promise, or the text of a LazyRope. Any
+    # other value, including other kinds of Promise, is returned unchanged.
+    if isinstance(value, LazyRope):
+        return value.render()
+    if isinstance(value, Promise):
+        # Looked up on the type: other Promise subclasses may proxy
+        # attribute access.
+        cast = getattr(type(value), '_proxy____cast', None)
+        if cast is not None:
+            return cast(value)
+    return value
+
+
+# Sorting or deduplicating promises directly forces both sides of every
+# comparison, and every hash. These helpers force each promise once.
+def sorted_promises(values, key=None, reverse=False):
+    """
+    Returns a new list of values, which may contain promises, sorted by
+    their evaluated values (passed through key, if given). Each promise is
+    evaluated once.
+    """
+    if key is None:
+        return sorted(values, key=_force, reverse=reverse)
+    return sorted(values, key=lambda value: key(_force(value)), reverse=reverse)
+
+
+def unique_promises(values):
+    """
+    Returns a list of values, which may contain promises, without the ones
+    whose evaluated value was already seen, preserving order. Each promise
+    is evaluated once.
+    """
+    seen = set()
+    result = []
+    for value in values:
+        forced = _force(value)
+        if forced not in seen:
+            seen.add(forced)
+            result.append(value)
+    return result
+
+
+def force_all(value):
+    """
+    Returns value with the promises, and the lazy objects that have already
+    been set up, replaced by their values, looking inside dicts, lists,
+    tuples and sets (and their subclasses) at any depth. Containers are
+    copied, not modified; shared and recursive containers stay so in the
+    copy. Lazy objects that haven't been set up are left alone.
+
+    Use it before a hot loop over a structure, so that each promise is
+    evaluated once instead of on every use.
+    """
+    return _force_all(value, {})
+
+
+def _force_all(value, memo):
+    # Only type(value) is looked at: isinstance() checks on a lazy object
+    # that fail on its type consult its proxied __class__, setting it up.
+    value_type = type(value)
+    if issubclass(value_type, WeakSimpleLazyObject):
+        # Reading its _wrapped would set it up if needed.
+        ref = value.__dict__['_wrappedref']
+        wrapped = None if ref is None else ref()
+        if wrapped is None:
+            return value
+        return _force_all(wrapped, memo)
+    if issubclass(value_type, CompactLazyObject):
+        if value._wrapped is empty:
+            return value
+        return _force_all(value._wrapped, memo)
+    if issubclass(value_type, Promise):
+        return _force(value)
+    if not issubclass(value_type, (dict, list, tuple, set, frozenset)):
+        return value
+    try:
+        return memo[id(value)]
+    except KeyError:
+        pass
+    if issubclass(value_type, dict):
+        # Copying keeps the dict type and its state (e.g. the default
+        # factory of a defaultdict).
+        result = memo[id(value)] = copy.copy(value)
+        result.clear()
+        for key, item in value.items():
+            result[_force_all(key, memo)] = _force_all(item, memo)
+    elif issubclass(value_type, list):
+        result = memo[id(value)] = copy.copy(value)
+        result[:] = [_force_all(item, memo) for item in value]
+    else:
+        items = [_force_all(item, memo) for item in value]
+        if hasattr(value_type, '_make'):
+            # A namedtuple.
+            result = value_type._make(items)
+        else:
+            result = value_type(items)
+        memo[id(value)] = result
+    return result
+
+
+# Batched implementations of lazily evaluated functions, for force_many().
+_batched_implementations = {}
+
+
+def register_batched(func, batched=None):
+    """
+    Registers batched as the batched implementation of func, a lazy()
+    function or the function it was made from, for force_many(). batched is
+    called with a list of distinct (args, kwargs) tuples and must return the
+    list of their results, in the same order.
+
+    Can also be used as a decorator:
+
+        @register_batched(ugettext_lazy)
+        def ugettext_many(calls):
+            ...
+    """
+    if batched is None:
+        return lambda batched: register_batched(func, batched)
+    _batched_implementations[func] = batched
+    wrapped = getattr(func, '__wrapped__', None)
+    if wrapped is not None:
+        _batched_implementations[wrapped] = batched
+    return batched
+
+
+def _call_key(value):
+    # A key for deduplicating calls by their arguments. Types are part of it,
+    # so that equal values of different types (1, 1.0 and True) are not
+    # merged.
+    if type(value) is tuple:
+        return (tuple, tuple(_call_key(item) for item in value))
+    return (type(value), value)
+
+
+def force_many(values):
+    """
+    Returns a list of the values, with the promises among them evaluated,
+    in input order.
+
+    The lazy() promises are grouped by function, and each distinct call is
+    only evaluated once, through the function's batched implementation if
+    it has one (see register_batched()). Calls are the same if their
+    arguments are hashable, equal and of the same types. The other promises
+    are evaluated one by one. Calls are not made in input order.
+    """
+    values = list(values)
+    results = list(values)
+    # func -> {call key: (args, kw, [indexes of the promises])}
+    groups = {}
+    for index, value in enumerate(values):
+        value_type = type(value)
+        # Only type(value) is checked, as in force_all().
+        if not issubclass(value_type, Promise):
+            continue
+        if issubclass(value_type, LazyRope) or value_type in _lazy_cached_proxy_classes.values():
+            # lazy_cached() promises memoize their result.
+            results[index] = _force(value)
+            continue
+        func = getattr(value, '_proxy____func', None)
+        if func is None:
+            # Not a lazy() promise.
+            continue
+        if isinstance(func, _LazyGraphFunction):
+            # allow_lazy() promises evaluate the promises they depend on.
+            results[index] = _force(value)
+            continue
+        args, kw = value._proxy____args, value._proxy____kw
+        key = (_call_key(args), tuple((name, _call_key(kw[name])) for name in sorted(kw)))
+        try:
+            hash(key)
+        except TypeError:
+            # Not deduplicated, except for repeats of the same promise.
+            key = (empty, id(value))
+        calls = groups.setdefault(func, {})
+        if key not in calls:
+            calls[key] = (args, kw, [])
+        calls[key][2].append(index)
+
+    for func, calls in groups.items():
+        calls = list(calls.values())
+        batched = _batched_implementations.get(func)
+        if batched is not None:
+            call_results = batched([(args, kw) for args, kw, indexes in calls])
+            if len(call_results) != len(calls):
+                raise ValueError("The batched implementation of %s returned %d results for %d calls." % (
+                    _instrumentation_name(func), len(call_results), len(calls)))
+        elif _instrumentation is None:
+            call_results = [func(*args, **kw) for args, kw, indexes in calls]
+        else:
+            call_results = [_instrumentation.call('lazy', func, args, kw) for args, kw, indexes in calls]
+        for (args, kw, indexes), res in zip(calls, call_results):
+            for index in indexes:
+                # As when forcing the promise itself.
+                results[index] = bytes(res) if values[index]._delegate_bytes else res
+    return results
+
+
+def _lazy_graph_children(node):
+    # The promises a node depends on. Only allow_lazy() promises have any:
+    # their arguments are forced before their function is called.
+    if not isinstance(getattr(node, '_proxy____func', None), _LazyGraphFunction):
+        return []
+    return [arg for arg in itertools.chain(node._proxy____args, six.itervalues(node._proxy____kw))
+            if isinstance(arg, Promise)]
+
+
+def _lazy_graph_order(roots):
+    # Returns the promises reachable from roots, each once, dependencies
+    # first. Iterative, so deep chains don't hit the recursion limit.
+    order = []
+    seen = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        for child in reversed(_lazy_graph_children(node)):
+            if id(child) not in seen:
+                stack.append((child, False))
+    return order
+
+
+class _LazyGraphFunction(object):
+    """
+    The function of an allow_lazy() promise. Calling it evaluates every
+    promise its arguments depend on once, shared sub-promises included, and
+    then calls func with the results.
+    """
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args, **kw):
+        values = {}
+
+        def resolve(value):
+            if isinstance(value, Promise):
+                return values[id(value)]
+            return value
+
+        roots = [arg for arg in itertools.chain(args, six.itervalues(kw)) if isinstance(arg, Promise)]
+        for node in _lazy_graph_order(roots):
+            if isinstance(getattr(node, '_proxy____func', None), _LazyGraphFunction):
+                node_func = node._proxy____func.func
+                node_args = [resolve(arg) for arg in node._proxy____args]
+                node_kw = dict((k, resolve(v)) for k, v in node._proxy____kw.items())
+                if _instrumentation is None:
+                    values[id(node)] = node_func(*node_args, **node_kw)
+                else:
+                    # Inner nodes aren't forced through __proxy__.__cast, so
+                    # record them here, against their own promise.
+                    values[id(node)] = _instrumentation.call('lazy', node_func, node_args, node_kw, node)
+            else:
+                values[id(node)] = _force(node)
+        return self.func(*[resolve(arg) for arg in args],
+                         **dict((k, resolve(v)) for k, v in kw.items()))
+
+    def __reduce__(self):
+        return (_unpickle_lazy_graph_function, _function_reference(self.func))
+
+
+def _unpickle_lazy_graph_function(func, unwrap):
+    if unwrap:
+        func = func.__wrapped__
+    return _LazyGraphFunction(func)
+
+
+def lazy_graph(promise):
+    """
+    Returns the evaluation graph of a promise, for debugging: a list of
+    (promise, function, args, kwargs) tuples, dependencies first and the
+    promise itself last. Each promise appears once, however many times it
+    is shared. Arguments that are promises depend on the nodes they refer
+    to.
+    """
+    graph = []
+    for node in _lazy_graph_order([promise]):
+        func = getattr(node, '_proxy____func', None)
+        if isinstance(func, _LazyGraphFunction):
+            func = func.func
+        graph.append((node, func, getattr(node, '_proxy____args', ()), getattr(node, '_proxy____kw', {})))
+    return graph
+
+
 def allow_lazy(func, *resultclasses):
     """
     A decorator that allows a function to be called with one or more lazy
     arguments. If none of the args are lazy, the function is evaluated
     immediately, otherwise a __proxy__ is returned that will evaluate the
     function when needed.
+
+    When the __proxy__ is evaluated, all the promises it depends on
+    (including promises returned by other allow_lazy() functions) are
+    evaluated once each, and func is called with their values.
     """
+    # Look up the lazy machinery once, up front. Calling lazy() inside
+    # wrapper would build a new lazy function for every call that received a
+    # Promise.
+    __proxy__ = _lazy_proxy_class(resultclasses)
+    graph_func = _LazyGraphFunction(func)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         # REVIEW: for/else control flow...
-        for arg in list(args) + list(six.itervalues(kwargs)):
+        for arg in itertools.chain(args, six.itervalues(kwargs)):
             if isinstance(arg, Promise):
                 break
         else:
             return func(*args, **kwargs)
+        if _eager_users and getattr(_eager_state, 'depth', 0):
+            return graph_func(*args, **kwargs)
         # REVIEW: If any argument is a Promise, further delay execution by
-        # constructing the lazy version of func, and then using that to return
-        # a new Promise for func(*args, **kwargs).
-        return lazy(func, *resultclasses)(*args, **kwargs)
+        # returning a new Promise for func(*args, **kwargs).
+        return __proxy__(graph_func, args, kwargs)
+    wrapper.__wrapped__ = func
     return wrapper
 
 empty = object()
@@ -332,24 +1530,26 @@ def new_method_proxy(func):
     # build-in Python magic methods, which don't accept kwargs. But then this
     # should be specified in the documentation.
     def inner(self, *args):
-        if self._wrapped is empty:
-            self._setup()
+        # _wrapped is read once: for some lazy objects it is computed.
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
         # REVIEW: self._wrapped is the proxied object, is passed as self.
-        return func(self._wrapped, *args)
+        return func(wrapped, *args)
     return inner
 
 
-class LazyObject(object):
+class CompactLazyObject(object):
     """
-    A wrapper for another class that can be used to delay instantiation of the
-    wrapped class.
+    A LazyObject that keeps _wrapped in a slot instead of an instance
+    __dict__.
 
-    By subclassing, you have the opportunity to intercept and alter the
-    instantiation. If you don't need to do that, use SimpleLazyObject.
+    Subclasses that declare their own __slots__ stay dict-free, which saves
+    memory when many lazy objects are alive at once. Subclasses that don't
+    get a __dict__ as usual.
     """
-
-    # Avoid infinite recursion when tracing __init__ (#19456).
-    _wrapped = None
+    __slots__ = ('_wrapped',)
 
     def __init__(self):
         self._wrapped = empty
@@ -359,29 +1559,62 @@ class LazyObject(object):
     # attribute on an object.  If it fails to find anything in __dict__ and in
     # superclasses, as a last resort it calls __getattr__.
     # REVIEW: Proxy most requests for attributes to the underlying wrapped object.
-    __getattr__ = new_method_proxy(getattr)
+    def __getattr__(self, name):
+        if name == "_wrapped":
+            # The _wrapped slot is read before __init__ has set it (e.g. when
+            # tracing __init__, #19456). Don't recurse trying to set it up.
+            raise AttributeError(name)
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
+        return getattr(wrapped, name)
 
     def __setattr__(self, name, value):
         if name == "_wrapped":
-            # Assign to __dict__ to avoid infinite __setattr__ loops.
-            self.__dict__["_wrapped"] = value
+            # Bypass this method to avoid infinite __setattr__ loops. This
+            # assigns to the slot, or to __dict__ in LazyObject.
+            object.__setattr__(self, "_wrapped", value)
         else:
-            if self._wrapped is empty:
-                self._setup()
-            setattr(self._wrapped, name, value)
+            wrapped = self._wrapped
+            if wrapped is empty:
+                _setup_lazy_object(self)
+                wrapped = self._wrapped
+            setattr(wrapped, name, value)
 
     def __delattr__(self, name):
         if name == "_wrapped":
             raise TypeError("can't delete _wrapped.")
-        if self._wrapped is empty:
-            self._setup()
-        delattr(self._wrapped, name)
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
+        delattr(wrapped, name)
 
     def _setup(self):
         """
         Must be implemented by subclasses to initialize the wrapped object.
         """
-        raise NotImplementedError('subclasses of LazyObject must provide a _setup() method')
+        raise NotImplementedError('subclasses of %s must provide a _setup() method' % type(self).__name__)
+
+    # Pickle the wrapped object itself. The default implementation would use
+    # self.__class__, which is proxied.
+    def __reduce__(self):
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
+        return (_unpickle_lazyobject, (wrapped,))
+
+    # copy.copy() would otherwise use __reduce__, and return the wrapped
+    # object itself.
+    def __copy__(self):
+        if self._wrapped is empty:
+            # If uninitialized, copy the wrapper. Use type(self), not
+            # self.__class__, because the latter is proxied.
+            return type(self)()
+        # If initialized, return a copy of the wrapped object.
+        return copy.copy(self._wrapped)
 
     if six.PY3:
         __bytes__ = new_method_proxy(bytes)
@@ -409,6 +1642,10 @@ class LazyObject(object):
     __eq__ = new_method_proxy(operator.eq)
     __ne__ = new_method_proxy(operator.ne)
     __hash__ = new_method_proxy(hash)
+    __lt__ = new_method_proxy(operator.lt)
+    __le__ = new_method_proxy(operator.le)
+    __gt__ = new_method_proxy(operator.gt)
+    __ge__ = new_method_proxy(operator.ge)
 
     # Dictionary methods support
     __getitem__ = new_method_proxy(operator.getitem)
@@ -419,10 +1656,40 @@ class LazyObject(object):
     __contains__ = new_method_proxy(operator.contains)
 
 
+class LazyObject(CompactLazyObject):
+    """
+    A wrapper for another class that can be used to delay instantiation of the
+    wrapped class.
+
+    By subclassing, you have the opportunity to intercept and alter the
+    instantiation. If you don't need to do that, use SimpleLazyObject.
+    """
+
+    # Avoid infinite recursion when tracing __init__ (#19456). This class
+    # attribute also shadows the _wrapped slot, so _wrapped lives in the
+    # instance __dict__.
+    _wrapped = None
+
+
+def _unpickle_lazyobject(wrapped):
+    return wrapped
+
+
 # Workaround for http://bugs.python.org/issue12370
 _super = super
 
 
+def _check_released_setup(lazy_object):
+    # Called by _setup() when the setup function was dropped after it ran.
+    # Usually another thread has just set lazy_object up, after the caller
+    # saw it empty; otherwise _wrapped was reset, and there is nothing left
+    # to set it up with.
+    if lazy_object._wrapped is empty:
+        raise ValueError(
+            "%s was reset after its setup function ran, and it keeps no "
+            "reference to that function." % type(lazy_object).__name__)
+
+
 class SimpleLazyObject(LazyObject):
     """
     A lazy object initialized from any function.
@@ -437,13 +1704,22 @@ class SimpleLazyObject(LazyObject):
         If copies are made of the resulting SimpleLazyObject, which can happen
         in various circumstances within Django, then you must ensure that the
         callable can be safely run more than once and will return the same
-        value.
+        value. SharedSimpleLazyObject runs it only once for all copies.
+
+        The callable is dropped once it has returned, so that whatever it
+        refers to can be freed. Setting _wrapped back to empty afterwards
+        isn't supported.
         """
         self.__dict__['_setupfunc'] = func
         _super(SimpleLazyObject, self).__init__()
 
     def _setup(self):
-        self._wrapped = self._setupfunc()
+        func = self._setupfunc
+        if func is None:
+            _check_released_setup(self)
+            return
+        self._wrapped = func()
+        self.__dict__['_setupfunc'] = None
 
     # Return a meaningful representation of the lazy object for debugging
     # without evaluating the wrapped object.
@@ -454,16 +1730,416 @@ class SimpleLazyObject(LazyObject):
             repr_attr = self._wrapped
         return '<%s: %r>' % (type(self).__name__, repr_attr)
 
+    # An unevaluated SimpleLazyObject is pickled with its setup function, to
+    # be evaluated wherever it is unpickled.
+    def __reduce__(self):
+        if self._wrapped is empty:
+            return (type(self), (self._setupfunc,))
+        return _super(SimpleLazyObject, self).__reduce__()
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self._setupfunc)
+        return copy.copy(self._wrapped)
+
     def __deepcopy__(self, memo):
         if self._wrapped is empty:
-            # We have to use SimpleLazyObject, not self.__class__, because the
+            # We have to use type(self), not self.__class__, because the
             # latter is proxied.
-            result = SimpleLazyObject(self._setupfunc)
+            result = type(self)(self._setupfunc)
             memo[id(self)] = result
             return result
         return copy.deepcopy(self._wrapped, memo)
 
 
+class CompactSimpleLazyObject(CompactLazyObject):
+    """
+    A SimpleLazyObject without an instance __dict__: _wrapped and _setupfunc
+    are kept in slots.
+    """
+    __slots__ = ('_setupfunc',)
+
+    def __init__(self, func):
+        """
+        Pass in a callable that returns the object to be wrapped.
+
+        The same caveat about copies as for SimpleLazyObject applies.
+        """
+        # Bypass __setattr__, like SimpleLazyObject's __dict__ assignment.
+        object.__setattr__(self, '_setupfunc', func)
+        _super(CompactSimpleLazyObject, self).__init__()
+
+    def _setup(self):
+        func = self._setupfunc
+        if func is None:
+            _check_released_setup(self)
+            return
+        self._wrapped = func()
+        object.__setattr__(self, '_setupfunc', None)
+
+    def __repr__(self):
+        if self._wrapped is empty:
+            repr_attr = self._setupfunc
+        else:
+            repr_attr = self._wrapped
+        return '<%s: %r>' % (type(self).__name__, repr_attr)
+
+    def __reduce__(self):
+        if self._wrapped is empty:
+            return (type(self), (self._setupfunc,))
+        return _super(CompactSimpleLazyObject, self).__reduce__()
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self._setupfunc)
+        return copy.copy(self._wrapped)
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            # As in SimpleLazyObject, self.__class__ is proxied.
+            result = type(self)(self._setupfunc)
+            memo[id(self)] = result
+            return result
+        return copy.deepcopy(self._wrapped, memo)
+
+
+class _SetupCell(object):
+    """
+    Runs a setup function at most once, from any number of threads, and
+    holds on to its result.
+    """
+    __slots__ = ('func', 'lock', 'future', 'value')
+
+    def __init__(self, func):
+        self.func = func
+        self.lock = threading.Lock()
+        self.future = None
+        self.value = empty
+
+    def get(self):
+        if self.value is empty:
+            with self.lock:
+                # Check again now that no other thread can be running func.
+                if self.value is empty:
+                    future = self.future
+                    if future is not None:
+                        self.future = None
+                        self.value = future.result()
+                    else:
+                        self.value = self.func()
+                    self.func = None
+        return self.value
+
+    def prewarm(self, executor):
+        with self.lock:
+            if self.value is empty and self.future is None:
+                self.future = executor.submit(self.func)
+            return self.future
+
+
+class ThreadSafeSimpleLazyObject(SimpleLazyObject):
+    """
+    A SimpleLazyObject whose setup function runs at most once, even when
+    several threads access it for the first time concurrently.
+
+    The setup function can also be started ahead of time in a thread pool
+    with prewarm(); the first access then waits for that computation
+    instead of starting its own. If the setup function raises, nothing is
+    stored and the next access tries again.
+    """
+    def __init__(self, func):
+        self.__dict__['_setupcell'] = _SetupCell(func)
+        _super(ThreadSafeSimpleLazyObject, self).__init__(func)
+
+    def _setup(self):
+        self._wrapped = self._setupcell.get()
+        self.__dict__['_setupfunc'] = None
+
+    def _prewarm(self, executor):
+        if self._wrapped is not empty:
+            return None
+        return self._setupcell.prewarm(executor)
+
+
+class SharedSimpleLazyObject(ThreadSafeSimpleLazyObject):
+    """
+    A ThreadSafeSimpleLazyObject whose unevaluated deep copies share its
+    setup cell, so the setup function runs at most once however many copies
+    are made.
+
+    The copies then wrap the same object. To keep copies independent,
+    setting or deleting attributes or items through a lazy object that
+    shares its result first replaces its own _wrapped with a deep copy of
+    it (copy-on-write). Changes made by calling methods of the wrapped
+    object (e.g. obj.append(...)) can't be detected, and are seen by every
+    copy that hasn't been written to.
+    """
+    def __init__(self, func):
+        self.__dict__['_setupshared'] = False
+        _super(SharedSimpleLazyObject, self).__init__(func)
+
+    def _unshare(self):
+        if self._wrapped is empty:
+            _setup_lazy_object(self)
+        if self._setupshared:
+            self._wrapped = copy.deepcopy(self._wrapped)
+            self.__dict__['_setupshared'] = False
+
+    def __setattr__(self, name, value):
+        if name != "_wrapped":
+            self._unshare()
+        _super(SharedSimpleLazyObject, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if name != "_wrapped":
+            self._unshare()
+        _super(SharedSimpleLazyObject, self).__delattr__(name)
+
+    def __setitem__(self, key, value):
+        self._unshare()
+        self._wrapped[key] = value
+
+    def __delitem__(self, key):
+        self._unshare()
+        del self._wrapped[key]
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            result = type(self)(self._setupfunc)
+            result.__dict__['_setupcell'] = self._setupcell
+            result.__dict__['_setupshared'] = True
+            self.__dict__['_setupshared'] = True
+            memo[id(self)] = result
+            return result
+        return copy.deepcopy(self._wrapped, memo)
+
+
+_prewarm_executor = None
+_prewarm_executor_lock = threading.Lock()
+
+
+def prewarm(lazy_object, executor=None):
+    """
+    Starts the setup function of a ThreadSafeSimpleLazyObject in a thread
+    pool (a shared module-level one unless executor is given), typically at
+    import or boot time.
+
+    Returns the future of the computation, or None if the object is already
+    set up.
+    """
+    global _prewarm_executor
+    # Checked on the type: attribute access on any other lazy object would be
+    # proxied, setting it up right here.
+    if not issubclass(type(lazy_object), ThreadSafeSimpleLazyObject):
+        raise TypeError("prewarm() needs a ThreadSafeSimpleLazyObject, not %s." % type(lazy_object).__name__)
+    if executor is None:
+        with _prewarm_executor_lock:
+            if _prewarm_executor is None:
+                _prewarm_executor = futures.ThreadPoolExecutor(max_workers=4)
+        executor = _prewarm_executor
+    return lazy_object._prewarm(executor)
+
+
+# Special methods that must stay the lazy object's own, even if the wrapped
+# type defines them.
+_unproxied_special_methods = frozenset([
+    '__new__', '__init__', '__del__', '__getattribute__', '__getattr__',
+    '__setattr__', '__delattr__', '__dict__', '__weakref__', '__slots__',
+    '__module__', '__doc__', '__qualname__', '__class__', '__init_subclass__',
+    '__subclasshook__', '__class_getitem__', '__set_name__', '__sizeof__',
+    '__reduce__', '__reduce_ex__', '__getstate__', '__setstate__',
+    '__getnewargs__', '__getnewargs_ex__', '__copy__', '__deepcopy__',
+    '__get__', '__set__', '__delete__', '__instancecheck__',
+    '__subclasscheck__', '__abstractmethods__',
+])
+
+
+def _special_method_proxy(name):
+    # Like new_method_proxy, but looks the method up on the type of the
+    # wrapped object, as Python does for implicit special method calls, and
+    # allows keyword arguments (e.g. for __call__).
+    def inner(self, *args, **kwargs):
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
+        return getattr(type(wrapped), name)(wrapped, *args, **kwargs)
+    inner.__name__ = name
+    return inner
+
+
+# In-place operators, which must return the lazy object itself rather than
+# the object they leave behind: x += y rebinds x to the returned value.
+_inplace_special_methods = frozenset([
+    '__iadd__', '__isub__', '__imul__', '__imatmul__', '__itruediv__',
+    '__ifloordiv__', '__idiv__', '__imod__', '__ipow__', '__ilshift__',
+    '__irshift__', '__iand__', '__ixor__', '__ior__',
+])
+
+
+def _inplace_special_method_proxy(name):
+    def inner(self, *args):
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
+        result = getattr(type(wrapped), name)(wrapped, *args)
+        if result is NotImplemented:
+            return result
+        self._wrapped = result
+        return self
+    inner.__name__ = name
+    return inner
+
+
+_typed_lazy_object_classes = {}
+
+
+def _unpickle_typed_lazy_object(wrapped_type, base, func):
+    return typed_lazy_object_class(wrapped_type, base)(func)
+
+
+def typed_lazy_object_class(wrapped_type, base=None):
+    """
+    Returns a subclass of base (SimpleLazyObject by default) that proxies
+    every special method defined by wrapped_type or its bases, such as
+    iteration, arithmetic, __call__ or context management. Implicit special
+    method calls skip __getattr__, so a plain lazy object only supports the
+    handful of special methods LazyObject defines.
+
+    The class is generated once per (wrapped_type, base) pair and cached.
+    """
+    if base is None:
+        base = SimpleLazyObject
+    key = (wrapped_type, base)
+    try:
+        return _typed_lazy_object_classes[key]
+    except KeyError:
+        pass
+
+    # Special methods that base (below object) already defines win, e.g.
+    # __repr__ and the LazyObject proxies.
+    defined = set()
+    for klass in base.__mro__[:-1]:
+        defined.update(klass.__dict__)
+    namespace = {'__slots__': (), '__module__': base.__module__, '__doc__': base.__doc__}
+    # As in lazy(), walk the mro in reverse so that overrides are seen last.
+    for klass in reversed(wrapped_type.__mro__[:-1]):
+        for name, value in klass.__dict__.items():
+            if (name.startswith('__') and name.endswith('__') and
+                    name not in _unproxied_special_methods and
+                    name not in defined and callable(value) and
+                    not isinstance(value, (classmethod, staticmethod))):
+                if name in _inplace_special_methods:
+                    namespace[name] = _inplace_special_method_proxy(name)
+                else:
+                    namespace[name] = _special_method_proxy(name)
+
+    if issubclass(base, (SimpleLazyObject, CompactSimpleLazyObject)):
+        # The generated class can't be pickled by reference.
+        def __reduce__(self):
+            if self._wrapped is empty:
+                return (_unpickle_typed_lazy_object, (wrapped_type, base, self._setupfunc))
+            return _super(cls, self).__reduce__()
+        namespace['__reduce__'] = __reduce__
+
+    cls = type(base)(base.__name__, (base,), namespace)
+    return _typed_lazy_object_classes.setdefault(key, cls)
+
+
+class CachingSimpleLazyObject(SimpleLazyObject):
+    """
+    A SimpleLazyObject that copies each attribute it proxies into its own
+    __dict__ after the first read. Later reads of that attribute are normal
+    instance attribute lookups, as fast as on the wrapped object itself.
+
+    Setting or deleting an attribute through the proxy discards its copy,
+    and replacing _wrapped discards them all. Changes made to the wrapped
+    object by other means are not seen for attributes that were already
+    read, so this is meant for objects that don't change once set up, such
+    as a request's user.
+    """
+    # Names that belong to the proxy itself and must never be shadowed.
+    _own_attributes = frozenset(['_wrapped', '_setupfunc'])
+
+    def __getattr__(self, name):
+        wrapped = self._wrapped
+        if wrapped is empty:
+            _setup_lazy_object(self)
+            wrapped = self._wrapped
+        value = getattr(wrapped, name)
+        if name not in self._own_attributes:
+            self.__dict__[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        if name == "_wrapped":
+            for cached in list(self.__dict__):
+                if cached not in self._own_attributes:
+                    del self.__dict__[cached]
+        else:
+            self.__dict__.pop(name, None)
+        _super(CachingSimpleLazyObject, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if name != "_wrapped":
+            self.__dict__.pop(name, None)
+        _super(CachingSimpleLazyObject, self).__delattr__(name)
+
+
+class WeakSimpleLazyObject(SimpleLazyObject):
+    """
+    A SimpleLazyObject that holds its result with a weak reference. Once
+    nothing else refers to the result and it has been garbage collected, the
+    next access calls the setup function again, so the setup function is
+    kept, and must be safe to run more than once.
+
+    This suits results that are expensive to hold on to but cheap enough to
+    recompute, or that some cache keeps alive for as long as it wants them.
+    The result must support weak references: instances of most classes do,
+    but not dicts, lists or strings.
+    """
+    def _get_wrapped(self):
+        ref = self.__dict__['_wrappedref']
+        value = None if ref is None else ref()
+        if value is None:
+            # The setup function is called here rather than in _setup(), so
+            # that the caller gets a strong reference to the result before it
+            # can be collected again.
+            if _instrumentation is None:
+                value = self._setupfunc()
+            else:
+                value = _instrumentation.call('setup', self._setupfunc, (), {})
+            self.__dict__['_wrappedref'] = weakref.ref(value)
+        return value
+
+    def _set_wrapped(self, value):
+        self.__dict__['_wrappedref'] = None if value is empty else weakref.ref(value)
+
+    # Never empty: reading it sets the object up if needed.
+    _wrapped = property(_get_wrapped, _set_wrapped)
+
+    def _setup(self):
+        self._get_wrapped()
+
+    def __repr__(self):
+        ref = self.__dict__['_wrappedref']
+        value = None if ref is None else ref()
+        return '<%s: %r>' % (type(self).__name__, self._setupfunc if value is None else value)
+
+    def __reduce__(self):
+        return (type(self), (self._setupfunc,))
+
+    def __copy__(self):
+        return type(self)(self._setupfunc)
+
+    def __deepcopy__(self, memo):
+        # A copy can recompute the result as well as this object can.
+        result = type(self)(self._setupfunc)
+        memo[id(self)] = result
+        return result
+
+
 # QUESTION: What happens when, in a subclass, you override the fget method for
 # a baseclass property, without redefining the property itself?
 # ANSWER: A property is a built-in descriptor type. ``foo.property`` is
@@ -521,18 +2197,193 @@ class lazy_property(property):
         return property(fget, fset, fdel, doc)
 
 
-def partition(predicate, values):
+# There is deliberately no lazy_property variant that resolves the functions
+# once per class. The only way to notice that a class (or one of its bases)
+# was monkey-patched is to look the name up on the class again, and that
+# lookup, which the interpreter already caches per class, is what such a
+# cache would save. Use cached_lazy_property when the value can be cached.
+class cached_lazy_property(cached_property):
+    """
+    A cached_property that computes its value with the most-derived
+    implementation of the decorated function, like lazy_property, and then
+    caches it on the instance under the property's own name.
+
+        class Foo(object):
+            def _get_bar(self):
+                ...
+            bar = cached_lazy_property(_get_bar)
+
+    On Python < 3.6, the name the property is assigned to must be passed as
+    name. Used as a decorator, it is a plain cached_property: subclasses
+    override the property itself.
+    """
+    def __init__(self, func, name=None):
+        super(cached_lazy_property, self).__init__(func)
+        self.name = name
+
+    def __set_name__(self, owner, name):
+        if self.name is None:
+            self.name = name
+
+    def __get__(self, instance, type=None):
+        if instance is None:
+            return self
+        if self.name is None:
+            raise TypeError("cached_lazy_property needs a name on this version of Python.")
+        if self.name == self.func.__name__:
+            # Used as a decorator: looking the function up by name would find
+            # this descriptor again.
+            func, args = self.func, (instance,)
+        else:
+            # As in lazy_property. This only runs until the value is cached.
+            func, args = getattr(instance, self.func.__name__), ()
+        if _instrumentation is None:
+            res = func(*args)
+        else:
+            res = _instrumentation.call('cached_property', func, args, {})
+        instance.__dict__[self.name] = res
+        return res
+
+    def clear(self, instance):
+        instance.__dict__.pop(self.name, None)
+
+
+class BucketStreams(object):
+    """
+    The lazy result of bucket(..., mode='stream'): streams[key] is an
+    iterator over the values that fall in that bucket, in order.
+
+    Values are pulled from the source only as the bucket iterators ask for
+    them. Values pulled on behalf of one bucket that belong to another are
+    buffered until that bucket's iterator reaches them, so only read from
+    the buckets you need, or read them roughly in step.
+    """
+    def __init__(self, get_bucket, values):
+        self._get_bucket = get_bucket
+        self._source = iter(values)
+        self._pending = defaultdict(deque)
+
+    def __getitem__(self, key):
+        return self._stream(key, self._pending[key])
+
+    def _stream(self, key, pending):
+        source, get_bucket, buffers = self._source, self._get_bucket, self._pending
+        while True:
+            if pending:
+                yield pending.popleft()
+                continue
+            for item in source:
+                item_key = get_bucket(item)
+                if item_key == key:
+                    break
+                buffers[item_key].append(item)
+            else:
+                return
+            yield item
+
+
+def _import_numpy(name, mode):
+    # NumPy is only imported when a vectorized mode is used, so that it
+    # doesn't weigh on the import of this module.
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("%s() needs NumPy for the '%s' mode." % (name, mode))
+    return numpy
+
+
+# Integer keys spanning fewer values than this are split with one mask per
+# value instead of a sort.
+_BUCKET_MASK_LIMIT = 16
+
+
+def _bucket_indices(get_bucket, values, numpy):
+    # Maps each bucket to the array of indices of its values, computing all
+    # the keys with a single call to the vectorized get_bucket.
+    keys = numpy.asarray(get_bucket(values))
+    if keys.dtype == bool:
+        # A mask: no sort needed.
+        return {False: numpy.flatnonzero(~keys), True: numpy.flatnonzero(keys)}
+    if keys.dtype.kind in 'iu' and keys.size:
+        # min() and max() are single passes, so a narrow range of integer
+        # keys is found without sorting.
+        low, high = int(keys.min()), int(keys.max())
+        if high - low < _BUCKET_MASK_LIMIT:
+            result = {}
+            for key in range(low, high + 1):
+                indices = numpy.flatnonzero(keys == key)
+                if len(indices):
+                    result[key] = indices
+            return result
+    # A single stable sort: the buckets are the runs of equal keys.
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    starts = numpy.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    unique_keys = sorted_keys[numpy.concatenate(([0], starts))] if sorted_keys.size else sorted_keys
+    return dict(zip(unique_keys.tolist(), numpy.split(order, starts)))
+
+
+def bucket(get_bucket, values, mode='list'):
+    """
+    Splits the values into buckets, keyed on the return value of get_bucket.
+    e.g.:
+
+        >>> bucket(lambda x: x % 3, range(7))
+        {0: [0, 3, 6], 1: [1, 4], 2: [2, 5]}
+
+    In the default 'list' mode the result is a defaultdict(list). The other
+    modes are:
+
+    * 'stream': returns a BucketStreams, which works on unbounded
+      iterables, only consuming them as its per-bucket iterators advance.
+    * 'indices': values is converted to a NumPy array and get_bucket must
+      be a vectorized function returning an array of keys (or a boolean
+      mask) for the whole array; returns a dict of index arrays, without
+      calling Python code for each element.
+    * 'array': as 'indices', but returns the values themselves.
+    """
+    if mode == 'list':
+        results = defaultdict(list)
+        for item in values:
+            results[get_bucket(item)].append(item)
+        return results
+    if mode == 'stream':
+        return BucketStreams(get_bucket, values)
+    if mode in ('indices', 'array'):
+        numpy = _import_numpy('bucket', mode)
+        values = numpy.asarray(values)
+        indices = _bucket_indices(get_bucket, values, numpy)
+        if mode == 'indices':
+            return indices
+        return dict((key, values[key_indices]) for key, key_indices in indices.items())
+    raise ValueError("Unknown bucket() mode %r." % mode)
+
+
+def partition(predicate, values, mode='list'):
     """
     Splits the values into two sets, based on the return value of the function
     (True/False). e.g.:
 
         >>> partition(lambda x: x > 3, range(5))
         [0, 1, 2, 3], [4]
+
+    mode is as for bucket(); in the NumPy modes predicate must return a
+    boolean mask for the whole array.
     """
-    results = ([], [])
-    for item in values:
-        results[predicate(item)].append(item)
-    return results
+    if mode == 'list':
+        results = ([], [])
+        for item in values:
+            results[predicate(item)].append(item)
+        return results
+    if mode in ('array', 'indices'):
+        numpy = _import_numpy('partition', mode)
+        values = numpy.asarray(values)
+        mask = numpy.asarray(predicate(values), dtype=bool)
+        if mode == 'indices':
+            return numpy.flatnonzero(~mask), numpy.flatnonzero(mask)
+        return values[~mask], values[mask]
+    buckets = bucket(predicate, values, mode)
+    return buckets[False], buckets[True]
 # REVIEW: Why not bucket on any function get_bucket? e.g.
 """
 def bucket(get_bucket, values):
@@ -0,0 +1,666 @@
+# coding: utf-8
+"""
+Micro-benchmarks for django.utils.functional.
+
+Run with ``python functional_benchmarks.py``. Each benchmark prints the
+average cost of a single call, in microseconds. Pass ``--large`` to include
+the benchmarks that need several GiB of memory.
+
+The regression suite (SUITE) runs last, and can be run alone with
+``--suite``. To check a change, store a baseline before making it and
+compare against it afterwards; the comparison exits with an error listing
+the benchmarks that got slower than the tolerance:
+
+    python functional_benchmarks.py --save baseline.json
+    python functional_benchmarks.py --compare baseline.json --tolerance 0.25
+"""
+
+from __future__ import print_function, unicode_literals
+import argparse
+import itertools
+import json
+import pickle
+import platform
+import sys
+import threading
+import timeit
+from functools import wraps
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import six
+
+from django.utils import functional as django_functional
+
+
+def bench(name, func, number=100000, repeat=3):
+    """
+    Time ``func()`` and print the best per-call cost, in microseconds.
+    """
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    usec = best / number * 1e6
+    print('{0:<50} {1:>10.3f} usec'.format(name, usec))
+    return usec
+
+
+def _allow_lazy_1_7(func, *resultclasses):
+    # The Django 1.7 implementation of allow_lazy(), kept here as the
+    # "before" measurement: it calls lazy() on every lazy call.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for arg in list(args) + list(six.itervalues(kwargs)):
+            if isinstance(arg, django_functional.Promise):
+                break
+        else:
+            return func(*args, **kwargs)
+        return django_functional.lazy(func, *resultclasses)(*args, **kwargs)
+    return wrapper
+
+
+def _curry_closure(_curried_func, *args, **kwargs):
+    # The Django 1.7 closure-based curry().
+    def _curried(*moreargs, **morekwargs):
+        return _curried_func(*(args + moreargs), **dict(kwargs, **morekwargs))
+    return _curried
+
+
+def bench_curry():
+    def target(*args, **kwargs):
+        pass
+
+    class Target(object):
+        def method(self, *args, **kwargs):
+            pass
+        closure_method = _curry_closure(method, foo='bar')
+        curry_method = django_functional.curry(method, foo='bar')
+
+    instance = Target()
+    # Currying a bound curried method keeps the instance it is bound to.
+    calls = []
+
+    class Recorder(object):
+        def method(self, *args, **kwargs):
+            calls.append((self, args, kwargs))
+        curry_method = django_functional.curry(method, foo='bar')
+    recorder = Recorder()
+    django_functional.curry(recorder.curry_method, 2)(3)
+    assert calls == [(recorder, (2, 3), {'foo': 'bar'})], calls
+
+    for label, curry in (('closure curry', _curry_closure), ('curry', django_functional.curry)):
+        once = curry(target, 1, foo='bar')
+        nested = curry(curry(curry(target, 1), 2), 3)
+        bench('{0}, call'.format(label), lambda: once(2))
+        bench('{0}, call with kwargs'.format(label), lambda: once(2, baz=3))
+        bench('{0}, 3 nested, call'.format(label), lambda: nested(4))
+    bench('closure curry, bound method', lambda: instance.closure_method(1))
+    bench('curry, bound method', lambda: instance.curry_method(1))
+
+
+def bench_allow_lazy():
+    def identity(s):
+        return s
+
+    old = _allow_lazy_1_7(identity, six.text_type)
+    new = django_functional.allow_lazy(identity, six.text_type)
+    promise = django_functional.lazy(identity, six.text_type)('lazy')
+
+    bench('allow_lazy 1.7, eager args', lambda: old('eager'))
+    bench('allow_lazy, eager args', lambda: new('eager'))
+    bench('allow_lazy 1.7, lazy args', lambda: old(promise), number=2000)
+    bench('allow_lazy, lazy args', lambda: new(promise))
+
+
+def _decorate_lazy_functions(n, shared=True):
+    # Decorate n functions with lazy() and create one promise for each. With
+    # shared=False the proxy class cache is cleared before every lazy() call,
+    # reproducing the 1.7 behaviour of preparing one __proxy__ class per
+    # decorated function.
+    promises = []
+    for i in range(n):
+        if not shared:
+            django_functional._lazy_proxy_classes.clear()
+        promises.append(django_functional.lazy(six.text_type, six.text_type)(i))
+    return promises
+
+
+def bench_lazy_startup():
+    for n in (1, 100, 1000):
+        for shared in (False, True):
+            label = 'shared' if shared else 'per-function'
+            django_functional._lazy_proxy_classes.clear()
+            if tracemalloc is not None:
+                tracemalloc.start()
+            timer = timeit.default_timer()
+            promises = _decorate_lazy_functions(n, shared)
+            elapsed = timeit.default_timer() - timer
+            if tracemalloc is not None:
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+            else:
+                memory = float('nan')
+            print('{0:<50} {1:>10.3f} msec {2:>10.1f} KiB'.format(
+                'lazy() startup, {0} functions, {1}'.format(n, label),
+                elapsed * 1e3, memory / 1024.0))
+            del promises
+
+
+def bench_lazy_dispatch():
+    text = django_functional.lazy(lambda: 'lazy text', six.text_type)()
+    number = django_functional.lazy(lambda: 42, int)()
+
+    bench('lazy text, upper()', lambda: text.upper())
+    bench('lazy text, [0]', lambda: text[0])
+    bench('lazy text, len()', lambda: len(text))
+    bench('lazy int, + 1', lambda: number + 1)
+
+    cached_text = django_functional.lazy_cached(lambda: 'lazy text', six.text_type)()
+    bench('lazy_cached text, upper()', lambda: cached_text.upper())
+    bench('lazy_cached text, str()', lambda: six.text_type(cached_text))
+    bench('lazy text, str()', lambda: six.text_type(text))
+
+
+class _DictLayoutPromise(django_functional.Promise):
+    # The 1.7 __proxy__ layout: a per-instance __dict__ holding the call.
+    def __init__(self, func, args, kw):
+        self.func = func
+        self.args = args
+        self.kw = kw
+
+
+def memory_per_instance(name, factory, n=10000):
+    """
+    Print the traced memory allocated per instance returned by
+    ``factory(i)``, averaged over n instances.
+    """
+    if tracemalloc is None:
+        print('{0:<50} {1:>10}'.format(name, 'n/a'))
+        return
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [factory(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # The list holding the instances is not part of the instances' cost.
+    per_instance = float(after - before - sys.getsizeof(instances)) / n
+    print('{0:<50} {1:>10.1f} bytes'.format(name, per_instance))
+    del instances
+
+
+def bench_memory():
+    lazy_text = django_functional.lazy(six.text_type, six.text_type)
+
+    memory_per_instance('dict layout promise', lambda i: _DictLayoutPromise(six.text_type, (i,), {}))
+    memory_per_instance('lazy() promise', lambda i: lazy_text(i))
+    memory_per_instance('SimpleLazyObject', lambda i: django_functional.SimpleLazyObject(dict))
+    memory_per_instance('CompactSimpleLazyObject', lambda i: django_functional.CompactSimpleLazyObject(dict))
+
+
+def bench_threadsafe_cached_property(threads=16):
+    # Release all threads at once on the first access to an expensive
+    # property, and check that it was computed exactly once.
+    calls = []
+    start = threading.Event()
+
+    class Aggregate(object):
+        @django_functional.threadsafe_cached_property
+        def total(self):
+            calls.append(None)
+            return sum(range(10 ** 6))
+
+    instance = Aggregate()
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(instance.total)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    timer = timeit.default_timer()
+    start.set()
+    for thread in workers:
+        thread.join()
+    elapsed = timeit.default_timer() - timer
+    assert len(calls) == 1, 'computed %d times' % len(calls)
+    assert len(set(results)) == 1 and len(results) == threads
+    assert not Aggregate.__dict__['total'].locks
+    print('{0:<50} {1:>10.3f} msec'.format(
+        'threadsafe_cached_property, {0} threads'.format(threads), elapsed * 1e3))
+
+    plain = Aggregate()
+    bench('threadsafe_cached_property, cached access', lambda: plain.total)
+
+
+def bench_lazy_object_attributes():
+    class User(object):
+        def __init__(self):
+            self.username = 'user'
+
+        def get_username(self):
+            return self.username
+
+    bare = User()
+    simple = django_functional.SimpleLazyObject(User)
+    compact = django_functional.CompactSimpleLazyObject(User)
+    caching = django_functional.CachingSimpleLazyObject(User)
+    for label, obj in (('bare object', bare), ('SimpleLazyObject', simple),
+                       ('CompactSimpleLazyObject', compact),
+                       ('CachingSimpleLazyObject', caching)):
+        bench('{0}, attribute'.format(label), lambda: obj.username)
+        bench('{0}, method call'.format(label), lambda: obj.get_username())
+
+    lazy_list = django_functional.typed_lazy_object_class(list)(lambda: list(range(100)))
+    bench('typed lazy list, iterate 100 items', lambda: sum(lazy_list), number=20000)
+    lazy_int = django_functional.typed_lazy_object_class(int)(lambda: 42)
+    bench('typed lazy int, + 1', lambda: lazy_int + 1)
+
+
+def bench_promise_sorting():
+    calls = []
+
+    def label(i):
+        calls.append(None)
+        return 'choice %05d' % i
+
+    lazy_label = django_functional.lazy(label, six.text_type)
+    for n in (100, 10000):
+        labels = [lazy_label((i * 7919) % n) for i in range(n)]
+        for name, sort in (('sorted()', sorted),
+                           ('sorted_promises()', django_functional.sorted_promises)):
+            del calls[:]
+            timer = timeit.default_timer()
+            sort(labels)
+            elapsed = timeit.default_timer() - timer
+            print('{0:<50} {1:>10.3f} msec {2:>10} calls'.format(
+                '{0}, {1} promises'.format(name, n), elapsed * 1e3, len(calls)))
+
+
+def bench_lazy_rope():
+    fragment = django_functional.lazy(lambda i: '%05d' % i * 20, six.text_type)
+    # Promises and ropes compose and compare in either order.
+    rope = django_functional.lazy_join(' ', ['a', 'b'])
+    promise = django_functional.lazy(lambda: 'x', six.text_type)()
+    assert six.text_type(promise + rope) == 'xa b'
+    assert six.text_type(rope + promise) == 'a bx'
+    assert promise != rope and not promise == rope and rope < promise
+    for n in (50, 1000):
+        fragments = [fragment(i) for i in range(n)]
+
+        def concatenate():
+            message = ''
+            for piece in fragments:
+                message = message + six.text_type(piece) + ' '
+            return message
+
+        rope = django_functional.lazy_join(' ', fragments)
+        bench('{0} lazy fragments, eager concatenation'.format(n), concatenate, number=200)
+        bench('{0} lazy fragments, lazy_join().render()'.format(n), rope.render, number=200)
+
+
+def label(i):
+    return 'label %d' % i
+# Decorated the usual way, so that pickling has to go through __wrapped__.
+label = django_functional.lazy(label, six.text_type)
+
+
+def make_settings():
+    return dict(('setting_%d' % i, i) for i in range(100))
+
+
+def bench_pickle():
+    protocol = pickle.HIGHEST_PROTOCOL
+    for name, obj, forced in (
+            ('lazy() promise', label(42), six.text_type(label(42))),
+            ('SimpleLazyObject', django_functional.SimpleLazyObject(make_settings), make_settings())):
+        for kind, value in (('lazy', obj), ('forced', forced)):
+            size = len(pickle.dumps(value, protocol))
+            usec = bench('{0}, {1}, pickle round trip'.format(name, kind),
+                         lambda: pickle.loads(pickle.dumps(value, protocol)), number=20000)
+            print('{0:<50} {1:>10} bytes'.format('{0}, {1}, pickle size'.format(name, kind), size))
+
+
+def bench_lazy_property():
+    class Base(object):
+        def _get_name(self):
+            return 'name'
+        plain = property(_get_name)
+        lazy = django_functional.lazy_property(_get_name)
+        cached = django_functional.cached_lazy_property(_get_name, 'cached')
+
+    class Child(Base):
+        def _get_name(self):
+            return 'child'
+
+    instance = Child()
+    bench('property', lambda: instance.plain)
+    bench('lazy_property', lambda: instance.lazy)
+    assert instance.cached == 'child'
+    bench('cached_lazy_property, cached access', lambda: instance.cached)
+
+
+def _timed(name, func):
+    timer = timeit.default_timer()
+    func()
+    elapsed = timeit.default_timer() - timer
+    print('{0:<50} {1:>10.3f} msec'.format(name, elapsed * 1e3))
+
+
+def bench_bucket(large=False):
+    # Pure Python modes on 10^6 elements; the NumPy modes also on 10^7 and,
+    # with --large (several GiB of memory), 10^8.
+    n = 10 ** 6
+    values = range(n)
+    _timed('partition(), list, 10^6', lambda: django_functional.partition(lambda x: x & 1, values))
+    _timed('bucket(), list, 10^6', lambda: django_functional.bucket(lambda x: x % 7, values))
+
+    def drain_one_bucket():
+        # Reading a single bucket of an unbounded iterable, in constant memory.
+        streams = django_functional.bucket(lambda x: x % 7, itertools.count(), mode='stream')
+        ones = streams[1]
+        for _ in range(n // 7):
+            next(ones)
+    _timed('bucket(), stream, 10^6 pulled', drain_one_bucket)
+
+    try:
+        import numpy
+    except ImportError:
+        print('{0:<50} {1:>10}'.format('bucket(), NumPy modes', 'n/a'))
+        return
+    exponents = (6, 7, 8) if large else (6, 7)
+    for exponent in exponents:
+        array = numpy.arange(10 ** exponent)
+        _timed('partition(), indices, 10^%d' % exponent,
+               lambda: django_functional.partition(lambda a: a & 1, array, 'indices'))
+        _timed('partition(), array, 10^%d' % exponent,
+               lambda: django_functional.partition(lambda a: a & 1, array, 'array'))
+        _timed('bucket(), indices, 10^%d' % exponent,
+               lambda: django_functional.bucket(lambda a: a % 7, array, 'indices'))
+        del array
+
+
+def bench_instrumentation():
+    text = django_functional.lazy(lambda: 'lazy text', six.text_type)()
+    bench('lazy text, str(), instrumentation disabled', lambda: six.text_type(text))
+    django_functional.enable_instrumentation()
+    try:
+        bench('lazy text, str(), instrumentation enabled', lambda: six.text_type(text))
+    finally:
+        django_functional.disable_instrumentation()
+
+
+def bench_eager_resolution():
+    lazy_label = django_functional.lazy(lambda i: 'label %d' % i, six.text_type)
+    bench('lazy(), call and str()', lambda: six.text_type(lazy_label(1)))
+    with django_functional.eager_resolution():
+        bench('lazy(), call and str(), eager_resolution()', lambda: six.text_type(lazy_label(1)))
+
+    rows = [{'label': lazy_label(i), 'choices': [lazy_label(j) for j in range(5)]} for i in range(100)]
+
+    def process(rows, passes=10):
+        for _ in range(passes):
+            [[choice.upper() for choice in row['choices']] + [row['label'].lower()] for row in rows]
+    bench('100 rows of promises, 10 passes', lambda: process(rows), number=50)
+    bench('100 rows of promises, force_all() then 10 passes',
+          lambda: process(django_functional.force_all(rows)), number=50)
+
+
+def bench_force_many():
+    # A translation-like lookup, with a fixed cost per call that the batched
+    # implementation pays once per batch.
+    catalog = dict(('msgid %d' % i, 'message %d' % i) for i in range(100))
+
+    def lookup(msgid):
+        sum(range(500))
+        return catalog[msgid]
+
+    def batched_lookup(msgid):
+        return lookup(msgid)
+
+    def lookup_many(calls):
+        sum(range(500))
+        return [catalog[args[0]] for args, kwargs in calls]
+
+    django_functional.register_batched(batched_lookup, lookup_many)
+    for name, func in (('lazy()', lookup), ('lazy() with a batched form', batched_lookup)):
+        lazy_func = django_functional.lazy(func, six.text_type)
+        promises = [lazy_func('msgid %d' % (i % 100)) for i in range(1000)]
+        bench('1000 promises, 100 distinct, {0}, str() each'.format(name),
+              lambda: [six.text_type(promise) for promise in promises], number=50)
+        bench('1000 promises, 100 distinct, {0}, force_many()'.format(name),
+              lambda: django_functional.force_many(promises), number=50)
+
+
+def bench_setup_retention():
+    # Memory still held by evaluated lazy objects whose setup function
+    # captured a large object, e.g. a request.
+    def make(i):
+        payload = bytearray(10000)
+
+        def setup():
+            return len(payload)
+        obj = django_functional.SimpleLazyObject(setup)
+        obj.bit_length()
+        return obj
+    memory_per_instance('evaluated SimpleLazyObject, 10 kB closure', make, n=1000)
+
+    class Result(object):
+        name = 'result'
+    kept = Result()
+    weak = django_functional.WeakSimpleLazyObject(lambda: kept)
+    bench('WeakSimpleLazyObject, attribute, result alive', lambda: weak.name)
+
+
+# The regression suite: (name, sizes, factory) cases, where factory(size)
+# returns the function to time. Sizes are input sizes (argument counts,
+# result lengths, list lengths) or, where there is no natural input size, the
+# number of operations done per call.
+
+def _suite_curry(size):
+    def target(*args):
+        pass
+    curried = django_functional.curry(target, *range(size))
+    return lambda: curried(1)
+
+
+def _suite_cached_property_first(size):
+    class Model(object):
+        @django_functional.cached_property
+        def value(self):
+            return 1
+    return lambda: [Model().value for _ in range(size)]
+
+
+def _suite_cached_property_repeat(size):
+    class Model(object):
+        @django_functional.cached_property
+        def value(self):
+            return 1
+    instance = Model()
+    return lambda: [instance.value for _ in range(size)]
+
+
+def _suite_lazy_creation(size):
+    lazy_func = django_functional.lazy(lambda *args: '', six.text_type)
+    args = tuple(range(size))
+    return lambda: lazy_func(*args)
+
+
+def _suite_lazy_cast(size):
+    text = django_functional.lazy(lambda: 'x' * size, six.text_type)()
+    return lambda: six.text_type(text)
+
+
+def _suite_lazy_dispatch(size):
+    text = django_functional.lazy(lambda: 'x' * size, six.text_type)()
+    return lambda: text.upper()
+
+
+def _suite_allow_lazy_eager(size):
+    func = django_functional.allow_lazy(lambda *args: '', six.text_type)
+    args = tuple(range(size))
+    return lambda: func(*args)
+
+
+def _suite_allow_lazy_lazy(size):
+    func = django_functional.allow_lazy(lambda *args: '', six.text_type)
+    args = tuple(range(size - 1)) + (django_functional.lazy(lambda: '', six.text_type)(),)
+    return lambda: six.text_type(func(*args))
+
+
+def _suite_lazy_object_attribute(size):
+    class User(object):
+        username = 'user'
+    user = django_functional.SimpleLazyObject(User)
+    return lambda: [user.username for _ in range(size)]
+
+
+def _suite_lazy_object_dunder(size):
+    values = django_functional.SimpleLazyObject(lambda: list(range(size)))
+    return lambda: (len(values), values[0], list(values))
+
+
+def _suite_lazy_property(size):
+    class Model(object):
+        def _get_value(self):
+            return 1
+        value = django_functional.lazy_property(_get_value)
+    instance = Model()
+    return lambda: [instance.value for _ in range(size)]
+
+
+def _suite_partition(size):
+    values = list(range(size))
+    return lambda: django_functional.partition(lambda x: x & 1, values)
+
+
+SUITE = [
+    ('curry, call', (0, 10, 100), _suite_curry),
+    ('cached_property, first access', (1, 100, 1000), _suite_cached_property_first),
+    ('cached_property, repeat access', (1, 100, 1000), _suite_cached_property_repeat),
+    ('lazy(), proxy creation', (0, 10, 100), _suite_lazy_creation),
+    ('lazy(), str() cast', (10, 1000, 100000), _suite_lazy_cast),
+    ('lazy(), method dispatch', (10, 1000, 100000), _suite_lazy_dispatch),
+    ('allow_lazy(), eager args', (1, 10, 100), _suite_allow_lazy_eager),
+    ('allow_lazy(), lazy args', (1, 10, 100), _suite_allow_lazy_lazy),
+    ('SimpleLazyObject, attribute', (1, 100, 1000), _suite_lazy_object_attribute),
+    ('SimpleLazyObject, dunder methods', (10, 1000, 100000), _suite_lazy_object_dunder),
+    ('lazy_property, access', (1, 100, 1000), _suite_lazy_property),
+    ('partition()', (100, 10000, 1000000), _suite_partition),
+]
+
+
+def measure(func, repeat=5, min_time=0.05):
+    """
+    Return the best per-call cost of ``func()``, in microseconds, timing
+    enough calls per repetition to take at least min_time seconds.
+    """
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= min_time:
+            break
+        number *= max(2, min(10, int(min_time / max(elapsed, 1e-9)) + 1))
+    best = min([elapsed] + timeit.repeat(func, number=number, repeat=repeat - 1))
+    return best / number * 1e6
+
+
+def run_suite():
+    """
+    Run every case of SUITE at every size, and return a dict of
+    'name [size]' -> per-call cost in microseconds.
+    """
+    results = {}
+    for name, sizes, factory in SUITE:
+        for size in sizes:
+            key = '{0} [{1}]'.format(name, size)
+            results[key] = measure(factory(size))
+            print('{0:<50} {1:>12.3f} usec'.format(key, results[key]))
+    return results
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as fileobj:
+        json.dump({
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'results': results,
+        }, fileobj, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(path, results, tolerance):
+    """
+    Print how results compare to the baseline stored at path, and return the
+    keys that got slower than the baseline by more than tolerance (a
+    fraction, e.g. 0.25 for 25%).
+    """
+    with open(path) as fileobj:
+        baseline = json.load(fileobj)
+    if baseline.get('python') != platform.python_version():
+        print('warning: the baseline was recorded with Python {0}.'.format(baseline.get('python')))
+    regressions = []
+    print()
+    print('{0:<50} {1:>12} {2:>12} {3:>8}'.format('benchmark', 'baseline', 'current', 'ratio'))
+    for key in sorted(results):
+        old = baseline['results'].get(key)
+        if old is None:
+            print('{0:<50} {1:>12} {2:>12.3f}'.format(key, 'new', results[key]))
+            continue
+        ratio = results[key] / old
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('{0:<50} {1:>12.3f} {2:>12.3f} {3:>7.2f}x{4}'.format(key, old, results[key], ratio, flag))
+    for key in sorted(set(baseline['results']) - set(results)):
+        print('{0:<50} {1:>12.3f} {2:>12}'.format(key, baseline['results'][key], 'missing'))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--large', action='store_true',
+                        help='include the benchmarks that need several GiB of memory')
+    parser.add_argument('--suite', action='store_true',
+                        help='only run the regression suite')
+    parser.add_argument('--save', metavar='PATH',
+                        help='run the regression suite and store its results as a baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='run the regression suite and compare it to a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown allowed by --compare, as a fraction (default: 0.25)')
+    options = parser.parse_args(argv)
+
+    if not (options.suite or options.save or options.compare):
+        bench_curry()
+        bench_allow_lazy()
+        bench_lazy_startup()
+        bench_lazy_dispatch()
+        bench_memory()
+        bench_threadsafe_cached_property()
+        bench_lazy_object_attributes()
+        bench_promise_sorting()
+        bench_lazy_rope()
+        bench_pickle()
+        bench_lazy_property()
+        bench_bucket(options.large)
+        bench_instrumentation()
+        bench_eager_resolution()
+        bench_force_many()
+        bench_setup_retention()
+        print()
+    results = run_suite()
+    if options.save:
+        save_baseline(options.save, results)
+    if options.compare:
+        regressions = compare_to_baseline(options.compare, results, options.tolerance)
+        if regressions:
+            sys.exit('\n{0} PERFORMANCE REGRESSION(S) of more than {1:.0%}:\n{2}'.format(
+                len(regressions), options.tolerance, '\n'.join('  ' + key for key in regressions)))
+
+
+if __name__ == '__main__':
+    main()